@@ -0,0 +1,312 @@
+#! /usr/bin/env python
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Headless batch mode: precompute every (site, variable, ensemble, frequency)
+product the dashboard shows and write it to a columnar output store.
+
+Example:
+    python climate-viewer/batch.py data/*.csv --out products --workers 8
+
+Each site is one input CSV (the site name is the file name without its
+extension). The time series of every unit is written to
+<out>/<site>/<variable>/<ensemble>/<frequency>.npz, and the seasonal cycles
+(full record and each baseline window), which do not depend on the
+frequency, once per (site, variable, ensemble) to seasonal_cycles.npz in the
+same directory. Every file records the options it was computed with. Units
+whose file already exists with the same options are skipped, so an
+interrupted run picks up where it stopped, while a rerun with other
+--baselines or --compact recomputes them.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import time
+import zipfile
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from data_processing import read_data, extract_time_information, get_shaded_data, member_columns
+from storage import save_frames
+
+
+VARIABLES = ["TREFHTMN", "TREFHTMX", "PRECT", "SOILWATER_10CM"]
+FREQUENCIES = ["Monthly", "Annual", "Decadal"]
+# -- "all" stands for "Average" plus every member found in the input
+ENSEMBLES = ["all"]
+BASELINES = [(1850, 1899), (1991, 2020)]
+
+# -- product holding the frequency-independent seasonal cycles
+SEASONAL_CYCLES = "seasonal_cycles"
+
+
+# -- units arrive site by site, so a worker only needs to keep the current one
+@lru_cache(maxsize=1)
+def load_site(file_name, compact=False):
+    """
+    Read and process a site file, keeping it while the worker is on that site.
+
+    :param file_name: Path to the site CSV file
+    :param compact: Use the compact (float32, narrow time keys) storage
+    :return: DataFrame with processed data
+    """
+    df = read_data(file_name, compact)
+    return extract_time_information(df, compact)
+
+
+def site_name(file_name):
+    """
+    Derive the site name from its input file name.
+
+    :param file_name: Path to the site CSV file
+    :return: File name without directory and extension
+    """
+    return os.path.splitext(os.path.basename(file_name))[0]
+
+
+def output_path(out_dir, file_name, var, ens, name):
+    """
+    Location of the output file for one work unit.
+
+    :param out_dir: Root of the output store
+    :param file_name: Path to the site CSV file
+    :param var: Variable name
+    :param ens: Ensemble name
+    :param name: Frequency ("Monthly", "Annual", or "Decadal") or SEASONAL_CYCLES
+    :return: Path of the .npz file for this unit
+    """
+    return os.path.join(out_dir, site_name(file_name), var, ens, f"{name}.npz")
+
+
+def parse_baseline(baseline):
+    """
+    Parse a baseline window such as "1991-2020".
+
+    Used as an argparse type, so a malformed window is reported before any
+    work starts.
+
+    :param baseline: String of the form "<first year>-<last year>"
+    :return: Tuple with first and last year
+    """
+    try:
+        first, last = (int(year) for year in baseline.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid baseline {baseline!r}, expected <first year>-<last year>"
+        )
+    if first > last:
+        raise argparse.ArgumentTypeError(f"invalid baseline {baseline!r}, first year after last")
+    return first, last
+
+
+def format_baselines(baselines):
+    """
+    Text form of baseline windows, as stored with the products.
+
+    :param baselines: Tuples with first and last year
+    :return: String such as "1850-1899 1991-2020"
+    """
+    return " ".join(f"{first}-{last}" for first, last in baselines)
+
+
+def ensemble_names(file_name, variables):
+    """
+    Ensembles available for every variable of a site file.
+
+    Only the header of the file is read.
+
+    :param file_name: Path to the site CSV file
+    :param variables: Variable names
+    :return: List with "Average" followed by the member numbers, in order
+    """
+    header = pd.read_csv(file_name, nrows=0)
+    members = None
+    for var in variables:
+        found = {col[len(var) + 1 :] for col in member_columns(header, var)}
+        members = found if members is None else members & found
+    return ["Average"] + sorted(members or [], key=int)
+
+
+def unit_options(baselines, compact):
+    """
+    Options a unit was computed with, as stored next to its products.
+
+    :param baselines: Baseline windows as (first, last) tuples
+    :param compact: Use the compact (float32, narrow time keys) storage
+    :return: DataFrame with one row
+    """
+    return pd.DataFrame({"baselines": [format_baselines(baselines)], "compact": [compact]})
+
+
+def is_done(path, baselines, compact):
+    """
+    Whether a unit's output file exists and was computed with the same options.
+
+    :param path: Path of the unit's .npz file
+    :param baselines: Baseline windows as (first, last) tuples
+    :param compact: Use the compact (float32, narrow time keys) storage
+    :return: True if the unit can be skipped
+    """
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            stored = (str(data["options/baselines"][0]), bool(data["options/compact"][0]))
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # -- missing, unreadable, or written before options were stored
+        return False
+    return stored == (format_baselines(baselines), compact)
+
+
+def compute_unit(unit):
+    """
+    Compute and store the products of one work unit.
+
+    Runs in a worker process. A frequency unit holds the time series at that
+    frequency; the SEASONAL_CYCLES unit holds the seasonal cycle over the
+    full record and for each baseline window.
+
+    :param unit: Tuple of (out_dir, file_name, var, ens, name, baselines, compact)
+    :return: Tuple with the unit's output path and compute time in seconds
+    """
+    out_dir, file_name, var, ens, name, baselines, compact = unit
+    start = time.perf_counter()
+    df_all = load_site(file_name, compact)
+    frames = {"options": unit_options(baselines, compact)}
+
+    # -- get_shaded_data reports progress on stdout; keep the batch log readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        if name == SEASONAL_CYCLES:
+            _, frames["seasonal_cycle"], _ = get_shaded_data(df_all, var, ens)
+            for first, last in baselines:
+                mask = (df_all["year"] >= first) & (df_all["year"] <= last)
+                _, df_baseline, _ = get_shaded_data(df_all.loc[mask], var, ens)
+                frames[f"seasonal_cycle_{first}_{last}"] = df_baseline
+        else:
+            frames["series"], _, _ = get_shaded_data(df_all, var, ens, name)
+
+    path = output_path(out_dir, file_name, var, ens, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_frames(path, frames)
+    return path, time.perf_counter() - start
+
+
+def build_units(files, out_dir, variables, ensembles, frequencies, baselines, compact=False):
+    """
+    List the work units that still need to be computed.
+
+    Every (site, variable, ensemble) gets one unit per frequency and one
+    SEASONAL_CYCLES unit. Units are ordered site by site so that consecutive
+    chunks handed to a worker share the same input file.
+
+    :param files: Site CSV files
+    :param out_dir: Root of the output store
+    :param variables: Variable names
+    :param ensembles: Ensemble names
+    :param frequencies: Frequencies to compute
+    :param baselines: Baseline windows as (first, last) tuples
+    :param compact: Use the compact (float32, narrow time keys) storage
+    :return: Tuple with the list of pending units and the number skipped
+    """
+    units = []
+    skipped = 0
+    names = [SEASONAL_CYCLES] + list(frequencies)
+    for file_name, var, ens, name in product(files, variables, ensembles, names):
+        # -- the time series do not depend on the baselines
+        unit_baselines = tuple(baselines) if name == SEASONAL_CYCLES else ()
+        if is_done(output_path(out_dir, file_name, var, ens, name), unit_baselines, compact):
+            skipped += 1
+            continue
+        units.append((out_dir, file_name, var, ens, name, unit_baselines, compact))
+    return units, skipped
+
+
+def run_batch(units, workers=None, chunksize=None):
+    """
+    Compute work units across a process pool and report progress.
+
+    :param units: Work units from build_units
+    :param workers: Number of worker processes (defaults to the CPU count)
+    :param chunksize: Units handed to a worker at a time
+    :return: Total wall time in seconds
+    """
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(units) // (workers * 4))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(compute_unit, units, chunksize=chunksize)
+        for done, (path, seconds) in enumerate(results, start=1):
+            elapsed = time.perf_counter() - start
+            remaining = elapsed / done * (len(units) - done)
+            print(
+                f"[{done}/{len(units)}] {path} ({seconds:.2f}s, "
+                f"elapsed {elapsed:.1f}s, eta {remaining:.1f}s)",
+                flush=True,
+            )
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="+", help="Site CSV files")
+    parser.add_argument("--out", default="products", help="Output directory")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes")
+    parser.add_argument("--chunksize", type=int, default=None, help="Units per task")
+    parser.add_argument("--variables", nargs="+", default=VARIABLES, choices=VARIABLES)
+    parser.add_argument(
+        "--ensembles",
+        nargs="+",
+        default=ENSEMBLES,
+        help='"Average", member numbers, or "all" for the average and every member',
+    )
+    parser.add_argument("--frequencies", nargs="+", default=FREQUENCIES, choices=FREQUENCIES)
+    parser.add_argument(
+        "--baselines",
+        nargs="*",
+        type=parse_baseline,
+        default=BASELINES,
+        help="Baseline windows for seasonal cycles, e.g. 1991-2020",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Compute from float32 members (half the memory per site)",
+    )
+    args = parser.parse_args(argv)
+
+    # -- check the ensembles against the data before any work is dispatched
+    available = ensemble_names(args.files[0], args.variables)
+    ensembles = []
+    for ens in args.ensembles:
+        names = available if ens == "all" else [ens]
+        ensembles.extend(name for name in names if name not in ensembles)
+    unknown = [ens for ens in ensembles if ens not in available]
+    if unknown:
+        parser.error(f"ensembles not found in {args.files[0]}: {', '.join(unknown)}")
+
+    units, skipped = build_units(
+        args.files,
+        args.out,
+        args.variables,
+        ensembles,
+        args.frequencies,
+        args.baselines,
+        args.compact,
+    )
+    print(f"{len(units)} units to compute, {skipped} already done")
+    if not units:
+        return
+
+    elapsed = run_batch(units, args.workers, args.chunksize)
+    print(f"Finished {len(units)} units in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#! /usr/bin/env python
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Timing breakdowns for the dashboard.
+
+Example (from the repository root):
+    python climate-viewer/benchmark.py startup --sessions 20
+    python climate-viewer/benchmark.py compare
+    python climate-viewer/benchmark.py extremes --members 100
+    python climate-viewer/benchmark.py sessions --sessions 40
+    python climate-viewer/benchmark.py batch --sites 16
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def bench_startup(sessions=10):
+    """
+    Report import time, first-session time and Nth-session time.
+
+    Documents are created through Bokeh's DirectoryHandler, the same way
+    `bokeh serve` creates one for every new browser session.
+
+    :param sessions: Number of sessions to create
+    """
+    start = time.perf_counter()
+    import pandas  # noqa: F401
+    from bokeh.application import Application
+    from bokeh.application.handlers.directory import DirectoryHandler
+
+    import_time = time.perf_counter() - start
+
+    app = Application(DirectoryHandler(filename=APP_DIR))
+    timings = []
+    for _ in range(sessions):
+        start = time.perf_counter()
+        app.create_document()
+        timings.append(time.perf_counter() - start)
+
+    later = timings[1:] or timings
+    print(f"import (pandas, bokeh):  {import_time * 1000:8.1f} ms")
+    print(f"first session:           {timings[0] * 1000:8.1f} ms")
+    print(f"Nth session (mean):      {sum(later) / len(later) * 1000:8.1f} ms")
+    print(f"Nth session (best):      {min(later) * 1000:8.1f} ms")
+
+
+def best_of(func, repeat):
+    """
+    Best wall time of several calls, with the functions' progress prints muted.
+
+    :param func: Callable to time
+    :param repeat: Number of calls
+    :return: Best time in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_compare(file_name, variables, repeat=20, compact=True):
+    """
+    Compare one batched multi-variable call with sequential single-variable calls.
+
+    :param file_name: Path to the CSV file
+    :param variables: Variables to compute
+    :param repeat: Number of timed calls per case
+    :param compact: Use the compact (float32, narrow time keys) storage
+    """
+    from data_processing import (
+        read_data,
+        extract_time_information,
+        get_shaded_data,
+        get_multi_shaded_data,
+    )
+
+    df_all = extract_time_information(read_data(file_name, compact), compact)
+    print(f"{len(variables)} variables, best of {repeat}")
+    for freq in ["Monthly", "Annual", "Decadal"]:
+        batched = best_of(
+            lambda: get_multi_shaded_data(df_all, variables, "Average", freq), repeat
+        )
+        sequential = best_of(
+            lambda: [get_shaded_data(df_all, var, "Average", freq) for var in variables],
+            repeat,
+        )
+        print(
+            f"{freq:8s} batched {batched * 1000:7.1f} ms   "
+            f"sequential {sequential * 1000:7.1f} ms   "
+            f"speedup {sequential / batched:4.1f}x"
+        )
+
+
+def bench_extremes(file_name, members=100, repeat=20, compact=True):
+    """
+    Time the extreme-event statistics on an ensemble of a given size.
+
+    The members in the file are repeated with small random perturbations until
+    every variable has the requested number of members.
+
+    :param file_name: Path to the CSV file
+    :param members: Number of ensemble members per variable
+    :param repeat: Number of timed calls per case
+    :param compact: Use the compact (float32, narrow time keys) storage
+    """
+    import numpy as np
+    import pandas as pd
+
+    from data_processing import (
+        read_data,
+        extract_time_information,
+        member_columns,
+        get_extreme_data,
+    )
+    from extremes import extreme_defaults
+
+    df_all = extract_time_information(read_data(file_name, compact), compact)
+    rng = np.random.default_rng(0)
+    columns = {"time": df_all["time"], "year": df_all["year"], "month": df_all["month"]}
+    for var in extreme_defaults:
+        values = df_all[member_columns(df_all, var)].to_numpy()
+        values = np.resize(values.T, (members, len(df_all))).T
+        values = values * rng.normal(1, 0.01, values.shape).astype(values.dtype)
+        for i in range(members):
+            columns[f"{var}_{i}"] = values[:, i]
+    df_all = pd.DataFrame(columns)
+
+    print(f"{members} members, {len(df_all)} months, best of {repeat}")
+    for var, (direction, threshold, _) in extreme_defaults.items():
+        for freq in ["Annual", "Decadal"]:
+            seconds = best_of(
+                lambda: get_extreme_data(df_all, var, threshold, direction == "above", freq),
+                repeat,
+            )
+            print(f"{var:15s} {freq:8s} {seconds * 1000:7.1f} ms")
+
+
+def open_sessions(url, sessions, opened, close):
+    """
+    Hold a number of client sessions open until told to close them.
+
+    Runs in a child process, so the client documents do not count towards the
+    server's memory.
+
+    :param url: URL of the app
+    :param sessions: Number of sessions to open
+    :param opened: Event set once all sessions are open
+    :param close: Event to wait for before closing them
+    """
+    from bokeh.client import pull_session
+
+    clients = [pull_session(url=url) for _ in range(sessions)]
+    opened.set()
+    close.wait()
+    for client in clients:
+        client.close()
+
+
+def bench_sessions(sessions=40, rounds=3, trace=False):
+    """
+    Load-test session creation and cleanup against a real Bokeh server.
+
+    A child process opens sessions with bokeh.client and closes them again.
+    After the server has discarded them, the server's memory and the number
+    of Bokeh documents it still holds are reported for every round.
+
+    :param sessions: Sessions opened per round
+    :param rounds: Number of rounds
+    :param trace: Also report memory held by Python objects (via tracemalloc),
+        which unlike the resident size is not inflated by the allocator
+        keeping freed pages
+    """
+    import asyncio
+    import gc
+    import multiprocessing
+    import threading
+    import tracemalloc
+
+    from bokeh.application import Application
+    from bokeh.application.handlers.directory import DirectoryHandler
+    from bokeh.document import Document
+    from bokeh.server.server import Server
+
+    import sessions as lifecycle
+
+    if trace:
+        tracemalloc.start()
+
+    app = Application(DirectoryHandler(filename=APP_DIR))
+    started = threading.Event()
+    state = {}
+
+    def serve():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        state["server"] = Server(
+            {"/": app},
+            port=0,
+            check_unused_sessions_milliseconds=100,
+            unused_session_lifetime_milliseconds=100,
+        )
+        state["server"].start()
+        started.set()
+        state["server"].io_loop.start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait()
+    url = f"http://localhost:{state['server'].port}/"
+
+    def run_clients(count, on_opened=None):
+        context = multiprocessing.get_context("spawn")
+        opened, close = context.Event(), context.Event()
+        client = context.Process(target=open_sessions, args=(url, count, opened, close))
+        client.start()
+        opened.wait()
+        result = on_opened() if on_opened else None
+        close.set()
+        client.join()
+
+        # -- wait for the server to discard the closed sessions
+        deadline = time.monotonic() + 30
+        while lifecycle.session_count() and time.monotonic() < deadline:
+            time.sleep(0.2)
+        time.sleep(0.5)
+        gc.collect()
+        return result
+
+    def live_documents():
+        return sum(isinstance(obj, Document) for obj in gc.get_objects())
+
+    def traced():
+        if not trace:
+            return ""
+        return f", {tracemalloc.get_traced_memory()[0] / 2**20:.2f} MB traced"
+
+    # -- one warm-up session loads the data and per-process resources
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_clients(1)
+    baseline = lifecycle.memory_in_use()
+    print(f"baseline: {baseline / 2**20:6.1f} MB, {live_documents()} documents{traced()}")
+
+    for i in range(rounds):
+        with contextlib.redirect_stdout(io.StringIO()):
+            peak, open_count = run_clients(
+                sessions, lambda: (lifecycle.memory_in_use(), lifecycle.session_count())
+            )
+        lifecycle.trim_memory()
+        after = lifecycle.memory_in_use()
+        print(
+            f"round {i + 1}: {open_count} sessions {peak / 2**20:6.1f} MB -> "
+            f"after cleanup {after / 2**20:6.1f} MB ({(after - baseline) / 2**20:+.1f} MB), "
+            f"{lifecycle.session_count()} sessions, {live_documents()} documents{traced()}"
+        )
+
+    state["server"].io_loop.add_callback(state["server"].stop)
+
+
+def bench_batch(file_name, sites=16, workers=None):
+    """
+    Compare batch throughput with one worker and with several.
+
+    The input file is copied under different site names so that there is
+    enough work to spread, and every run writes to a fresh output directory.
+
+    :param file_name: Path to the CSV file used for every site
+    :param sites: Number of sites
+    :param workers: Worker processes for the parallel run (defaults to the CPU count)
+    """
+    from batch import VARIABLES, FREQUENCIES, BASELINES, build_units, run_batch
+
+    workers = workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = []
+        for i in range(sites):
+            files.append(os.path.join(tmp_dir, f"site{i:03d}.csv"))
+            shutil.copy(file_name, files[-1])
+
+        timings = {}
+        for count in sorted({1, workers}):
+            out_dir = os.path.join(tmp_dir, f"products_{count}")
+            units, _ = build_units(files, out_dir, VARIABLES, ["Average"], FREQUENCIES, BASELINES)
+            with contextlib.redirect_stdout(io.StringIO()):
+                timings[count] = run_batch(units, count)
+
+    print(f"{sites} sites, {len(units)} units")
+    for count, seconds in timings.items():
+        speedup = timings[1] / seconds
+        print(
+            f"{count:3d} workers {seconds:7.1f} s   {len(units) / seconds:6.1f} units/s   "
+            f"speedup {speedup:4.1f}x   efficiency {speedup / count:4.0%}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dashboard timing breakdowns")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    startup = subparsers.add_parser("startup", help="Server startup and session creation")
+    startup.add_argument("--sessions", type=int, default=10)
+
+    compare = subparsers.add_parser("compare", help="Batched multi-variable aggregation")
+    compare.add_argument("--file", default="data/dummy.csv")
+    compare.add_argument(
+        "--variables",
+        nargs="+",
+        default=["TREFHTMN", "TREFHTMX", "PRECT", "SOILWATER_10CM"],
+    )
+    compare.add_argument("--repeat", type=int, default=20)
+
+    extremes = subparsers.add_parser("extremes", help="Extreme-event statistics")
+    extremes.add_argument("--file", default="data/dummy.csv")
+    extremes.add_argument("--members", type=int, default=100)
+    extremes.add_argument("--repeat", type=int, default=20)
+
+    load = subparsers.add_parser("sessions", help="Session load test")
+    load.add_argument("--sessions", type=int, default=40)
+    load.add_argument("--rounds", type=int, default=3)
+    load.add_argument("--trace", action="store_true", help="Also trace Python allocations")
+
+    batch = subparsers.add_parser("batch", help="Batch products, 1 vs N workers")
+    batch.add_argument("--file", default="data/dummy.csv")
+    batch.add_argument("--sites", type=int, default=16)
+    batch.add_argument("--workers", type=int, default=None)
+
+    args = parser.parse_args(argv)
+    # -- the app and its data paths are relative to the repository root
+    os.chdir(os.path.dirname(APP_DIR))
+    sys.path.insert(0, APP_DIR)
+
+    if args.command == "startup":
+        bench_startup(args.sessions)
+    elif args.command == "compare":
+        bench_compare(args.file, args.variables, args.repeat)
+    elif args.command == "extremes":
+        bench_extremes(args.file, args.members, args.repeat)
+    elif args.command == "sessions":
+        bench_sessions(args.sessions, args.rounds, args.trace)
+    elif args.command == "batch":
+        bench_batch(args.file, args.sites, args.workers)
+
+
+if __name__ == "__main__":
+    main()
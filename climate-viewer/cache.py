@@ -0,0 +1,252 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Persistent on-disk cache for processed data and aggregations.
+
+Entries are .npz files written with storage.save_frames. Each entry is keyed
+by a hash of the input file contents, the computation parameters and the
+source of data_processing.py, so editing either the data or the processing
+code invalidates old entries automatically. The directory is kept below a
+size limit by removing the least recently used entries. Several server
+processes may share one directory, so an entry can disappear at any time.
+"""
+
+import hashlib
+import json
+import os
+import zipfile
+
+import data_processing
+
+from data_processing import (
+    memory_usage,
+    read_data,
+    extract_time_information,
+    get_shaded_data,
+    get_extreme_data,
+)
+from storage import save_frames, load_frames
+
+
+# -- bump when the layout of cache entries changes
+CACHE_FORMAT = 1
+
+CACHE_DIR = os.environ.get("CLIMATE_VIEWER_CACHE_DIR", "cache")
+CACHE_MAX_BYTES = int(os.environ.get("CLIMATE_VIEWER_CACHE_MAX_MB", "256")) * 2**20
+
+# -- in-process memos, shared by every session of the server
+_file_hashes = {}
+_datasets = {}
+_code_version = None
+# -- cache directory -> its size as of the last scan plus the entries this
+# -- process has written since, so a miss only rescans near the size limit
+_cache_bytes = {}
+
+
+def file_hash(file_name):
+    """
+    Hash the contents of a file.
+
+    The hash is remembered until the file's size or modification time
+    changes, so repeated calls only cost a stat.
+
+    :param file_name: Path to the file
+    :return: Hex digest of the file contents
+    """
+    stat = os.stat(file_name)
+    memo_key = (os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size)
+    if memo_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(file_name, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                digest.update(block)
+        _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def code_version():
+    """
+    Hash of the processing code the cached results were computed with.
+
+    :return: Hex digest of the cache format and data_processing.py
+    """
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+        with open(data_processing.__file__, "rb") as f:
+            digest.update(f.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def cache_key(*parts):
+    """
+    Build a cache key from the code version and computation parameters.
+
+    :param parts: JSON-serialisable values describing the computation
+    :return: Hex digest identifying the cache entry
+    """
+    payload = json.dumps([code_version(), *parts])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def prune_cache(cache_dir=None, max_bytes=None):
+    """
+    Remove least recently used entries until the cache fits its size limit.
+
+    :param cache_dir: Cache directory
+    :param max_bytes: Maximum total size of the cache in bytes
+    :return: Number of removed entries
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npz"):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # -- pruned by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        else:
+            removed += 1
+        total -= size
+    _cache_bytes[cache_dir] = total
+    return removed
+
+
+def load_or_compute(key, compute, cache_dir=None):
+    """
+    Return cached frames for a key, computing and storing them on a miss.
+
+    :param key: Cache key from cache_key
+    :param compute: Callable returning a dict of DataFrames
+    :param cache_dir: Cache directory
+    :return: Dict of DataFrames
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    path = os.path.join(cache_dir, key + ".npz")
+
+    if os.path.exists(path):
+        try:
+            frames = load_frames(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # -- unreadable entry (e.g. truncated disk); fall through and rebuild
+            pass
+        else:
+            # -- mark as recently used for LRU pruning
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # -- pruned by another process after we read it
+                pass
+            return frames
+
+    frames = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    save_frames(path, frames)
+
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        size = 0
+    total = _cache_bytes.get(cache_dir)
+    if total is None or total + size > CACHE_MAX_BYTES:
+        prune_cache(cache_dir)
+    else:
+        _cache_bytes[cache_dir] = total + size
+    return frames
+
+
+def cached_read_data(file_name, compact=False, cache_dir=None):
+    """
+    Read and process a data file through the cache.
+
+    The processed DataFrame is also kept in memory, so every session of a
+    server process shares one copy.
+
+    :param file_name: Path to the CSV file
+    :param compact: Use the compact (float32, narrow time keys) storage
+    :param cache_dir: Cache directory
+    :return: DataFrame with processed data and time information
+    """
+    data_hash = file_hash(file_name)
+    if (data_hash, compact) not in _datasets:
+
+        def compute():
+            df = read_data(file_name, compact)
+            return {"data": extract_time_information(df, compact)}
+
+        key = cache_key("read_data", data_hash, compact)
+        frames = load_or_compute(key, compute, cache_dir)
+        _datasets[data_hash, compact] = frames["data"]
+        # -- logged once per process, not once per session
+        print(f"Site data for {file_name}: {memory_usage(frames['data'])} bytes")
+    return _datasets[data_hash, compact]
+
+
+def cached_shaded_data(file_name, df_all, var, ens, freq="Monthly", cache_dir=None):
+    """
+    Calculate shaded data through the cache.
+
+    Only meant for the full record: results for arbitrary year ranges would
+    each be used once and push useful entries out of the cache.
+
+    :param file_name: Path to the CSV file df_all was read from
+    :param df_all: DataFrame containing all data
+    :param var: Variable to be used for calculations
+    :param ens: Ensemble for the variable
+    :param freq: Frequency for calculations, one of "Monthly", "Annual", or "Decadal"
+    :param cache_dir: Cache directory
+    :return: Tuple with data output, monthly data, and selected monthly data
+    """
+
+    def compute():
+        df_out, df_monthly, df_monthly_selected = get_shaded_data(df_all, var, ens, freq)
+        return {"out": df_out, "monthly": df_monthly, "monthly_selected": df_monthly_selected}
+
+    # -- results differ between full and compact storage
+    dtypes = sorted(set(map(str, df_all.dtypes)))
+    key = cache_key("shaded_data", file_hash(file_name), dtypes, var, ens, freq)
+    frames = load_or_compute(key, compute, cache_dir)
+    return frames["out"], frames["monthly"], frames["monthly_selected"]
+
+
+def cached_extreme_data(file_name, df_all, var, threshold, above=True, freq="Annual", cache_dir=None):
+    """
+    Calculate threshold-exceedance statistics through the cache.
+
+    :param file_name: Path to the CSV file df_all was read from
+    :param df_all: DataFrame containing all data
+    :param var: Variable to be used for calculations
+    :param threshold: Threshold in the units of the variable
+    :param above: Count months above the threshold (else below it)
+    :param freq: Period to count over, one of "Annual" or "Decadal"
+    :param cache_dir: Cache directory
+    :return: Tuple with exceedance counts per period, longest run per period
+        and empirical return periods
+    """
+
+    def compute():
+        df_counts, df_runs, df_return = get_extreme_data(df_all, var, threshold, above, freq)
+        return {"counts": df_counts, "runs": df_runs, "return": df_return}
+
+    dtypes = sorted(set(map(str, df_all.dtypes)))
+    key = cache_key(
+        "extreme_data", file_hash(file_name), dtypes, var, float(threshold), bool(above), freq
+    )
+    frames = load_or_compute(key, compute, cache_dir)
+    return frames["counts"], frames["runs"], frames["return"]
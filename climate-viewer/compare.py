@@ -0,0 +1,179 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Side-by-side comparison of several variables (and frequencies).
+
+All selected variables are reduced over the ensemble in one batched call to
+get_multi_shaded_data per frequency. Every time-series panel shares one
+x-range, and a box-select on any of them recomputes the seasonal cycle of
+every variable for the selected years.
+"""
+
+import calendar
+
+import numpy as np
+
+from bokeh.layouts import row, column
+from bokeh.models import CheckboxButtonGroup, ColumnDataSource, MultiChoice
+from bokeh.plotting import figure
+
+from data_processing import get_multi_shaded_data, year_range
+from plot_utils import var_labels, freq_list, band_plot
+
+
+tools_options = "pan, wheel_zoom, box_zoom, box_select, undo, save, reset"
+
+
+def tseries_plot(p, source, y_axis_label):
+    """
+    Draw the ensemble mean and min/max band of one variable.
+
+    Args:
+        p: A Bokeh figure on which the plot is drawn.
+        source: ColumnDataSource with time, var, var_lower and var_upper.
+        y_axis_label: Label for the y-axis.
+    """
+    band_plot(p, source, "navy", "#6495ED")
+    p.circle("time", "var", size=5, source=source, color="navy", selection_color="navy")
+    p.xaxis.axis_label = "Time"
+    p.yaxis.axis_label = y_axis_label
+
+
+def seasonal_plot(q, source, y_axis_label):
+    """
+    Draw the seasonal cycle of one variable.
+
+    Args:
+        q: A Bokeh figure on which the plot is drawn.
+        source: ColumnDataSource with month and var.
+        y_axis_label: Label for the y-axis.
+    """
+    q.line("month", "var", source=source, alpha=0.7, line_width=3, color="red")
+    q.circle("month", "var", source=source, alpha=0.7, size=4, color="red")
+    q.xaxis.axis_label = "Month"
+    q.yaxis.axis_label = y_axis_label
+    q.xaxis.major_label_orientation = np.pi / 4
+    q.xaxis.major_label_overrides = dict(enumerate(calendar.month_abbr))
+    q.grid.grid_line_alpha = 0.5
+
+
+def comparison_view(df_all, ens="Average", variables=("TREFHTMX", "PRECT"), freqs=("Annual",)):
+    """
+    Build the multi-variable comparison layout.
+
+    Args:
+        df_all: DataFrame containing all data.
+        ens: Ensemble for the variables.
+        variables: Variables shown initially.
+        freqs: Frequencies shown initially.
+
+    Returns:
+        A Bokeh layout with the controls and one row of panels per variable.
+    """
+    menu_vars = MultiChoice(
+        options=[(var, label) for var, label in var_labels.items()],
+        value=list(variables),
+        title="Variables",
+    )
+    menu_freqs = CheckboxButtonGroup(
+        labels=freq_list, active=[freq_list.index(freq) for freq in freqs]
+    )
+    grid = column()
+
+    # -- seasonal cycles over the full record, restored when nothing is selected
+    full_cycles = {}
+    cycle_sources = {}
+    cycle_figures = {}
+
+    def update_cycles(year_min=None, year_max=None):
+        """
+        Recompute the seasonal cycle of every variable for a range of years.
+        """
+        if year_min is None:
+            for var, source in cycle_sources.items():
+                source.data = dict(full_cycles[var])
+                cycle_figures[var].title.text = "Seasonal Cycle for 1850-2100"
+            return
+
+        mask = (df_all["year"] >= year_min) & (df_all["year"] <= year_max)
+        results = get_multi_shaded_data(df_all.loc[mask], list(cycle_sources), ens)
+        for var, source in cycle_sources.items():
+            source.data = ColumnDataSource.from_df(results[var][1])
+            if year_min == year_max:
+                cycle_figures[var].title.text = f"Seasonal Cycle for {year_min}"
+            else:
+                cycle_figures[var].title.text = f"Seasonal Cycle for {year_min}-{year_max}"
+
+    def selection_handler(source, freq):
+        def selection_change(attr, old, new):
+            if not new:
+                update_cycles()
+                return
+            # -- decadal points sit mid-decade; select by the years they cover
+            update_cycles(*year_range(source.data["period_start"][new], freq))
+
+        return selection_change
+
+    def build(attr, old, new):
+        """
+        Rebuild the panels for the selected variables and frequencies.
+        """
+        variables = list(menu_vars.value)
+        freqs = [freq_list[i] for i in sorted(menu_freqs.active)]
+        full_cycles.clear()
+        cycle_sources.clear()
+        cycle_figures.clear()
+        if not variables or not freqs:
+            grid.children = []
+            return
+
+        # -- one batched reduction over all variables per frequency
+        results = {freq: get_multi_shaded_data(df_all, variables, ens, freq) for freq in freqs}
+
+        rows = []
+        x_range = None
+        cycle_x_range = None
+        for var in variables:
+            panels = []
+            for freq in freqs:
+                source = ColumnDataSource(results[freq][var][0])
+                source.selected.on_change("indices", selection_handler(source, freq))
+
+                kwargs = {} if x_range is None else {"x_range": x_range}
+                p = figure(
+                    tools=tools_options,
+                    x_axis_type="datetime",
+                    active_drag="box_select",
+                    width=600,
+                    height=300,
+                    title=f"{var_labels[var]} ({freq})",
+                    **kwargs,
+                )
+                x_range = p.x_range
+                tseries_plot(p, source, var_labels[var])
+                panels.append(p)
+
+            full_cycles[var] = ColumnDataSource.from_df(results[freqs[0]][var][1])
+            cycle_sources[var] = ColumnDataSource(dict(full_cycles[var]))
+
+            kwargs = {} if cycle_x_range is None else {"x_range": cycle_x_range}
+            q = figure(
+                tools="",
+                width=400,
+                height=300,
+                title="Seasonal Cycle for 1850-2100",
+                **kwargs,
+            )
+            cycle_x_range = q.x_range
+            seasonal_plot(q, cycle_sources[var], var_labels[var])
+            cycle_figures[var] = q
+            panels.append(q)
+            rows.append(row(*panels))
+
+        grid.children = rows
+
+    menu_vars.on_change("value", build)
+    menu_freqs.on_change("active", build)
+    build("value", None, menu_vars.value)
+
+    return column(row(menu_vars, menu_freqs), grid)
@@ -1,6 +1,7 @@
 # Author: Negin Sobhani
 # Email: negins@ucar.edu
 
+import numpy as np
 import pandas as pd
 import calendar
 
@@ -31,11 +32,12 @@ def convert_precipitation(df, col_names):
     return df
 
 
-def read_data(file_name="dummy.csv"):
+def read_data(file_name="dummy.csv", compact=False):
     """
     Read and process data from a CSV file.
     
     :param file_name: Path to the CSV file
+    :param compact: Store ensemble members as float32 instead of float64
     :return: DataFrame with processed data
     """
     df = pd.read_csv(file_name)
@@ -44,16 +46,28 @@ def read_data(file_name="dummy.csv"):
     col_names = df.columns[df.columns.str.contains(pat="PREC")]
     df = convert_precipitation(df, col_names)
     df["time"] = pd.to_datetime(df["time"], infer_datetime_format=True)
+    if compact:
+        # -- the source values only carry ~7 significant digits
+        col_names = df.columns.drop("time")
+        df[col_names] = df[col_names].astype("float32")
     return df
 
 
-def extract_time_information(df):
+def extract_time_information(df, compact=False):
     """
     Extract time-related information from the DataFrame.
     
     :param df: DataFrame containing a 'time' column
+    :param compact: Only add narrow year and month columns
     :return: DataFrame with extracted time information
     """
+    if compact:
+        # -- day and hour are not used by any aggregation; derive them from
+        # -- "time" if they are ever needed
+        df["year"] = df["time"].dt.year.astype("int16")
+        df["month"] = df["time"].dt.month.astype("int8")
+        return df
+
     # -- extract year, month, day, hour information from time
     df["year"] = df["time"].dt.year
     df["month"] = df["time"].dt.month
@@ -62,104 +76,308 @@ def extract_time_information(df):
     return df
 
 
-def get_shaded_data(df_all, var, ens, freq="Monthly"):
+def memory_usage(df):
     """
-    Calculate shaded data based on the provided variable and frequency.
+    Number of bytes held by a DataFrame, including its index.
     
-    :param df_all: DataFrame containing all data
-    :param var: Variable to be used for calculations
-    :param ens: Ensemble for the variable
-    :param freq: Frequency for calculations, one of "Monthly", "Annual", or "Decadal"
-    :return: Tuple with data output, monthly data, and selected monthly data
+    :param df: DataFrame to measure
+    :return: Size in bytes
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def member_columns(df, var):
+    """
+    Names of the ensemble member columns of a variable.
+    
+    :param df: DataFrame containing all data
+    :param var: Variable name
+    :return: Index with the matching column names
     """
-    print(f"Calculating {freq} average for {var}...")
+    return df.columns[df.columns.str.contains(pat=var)]
+
 
-        # Extract columns with variable name.
-    col_names = df_all.columns[df_all.columns.str.contains(pat=var)]
+STATS = ["var", "var_lower", "var_upper"]
 
-    # Average all columns with this variable name.
-    this = df_all[col_names].mean(axis=1)
-    this_std = df_all[col_names].std(axis=1)
 
-    # Create a DataFrame with average ensemble for that variable.
-    df_this = pd.DataFrame(
-        {"time": df_all["time"], "year": df_all["year"], "month": df_all["month"], "var": this}
+def ensemble_stats(members, n_vars):
+    """
+    Ensemble mean, minimum and maximum over the member axis.
+    
+    The member block of every variable is reduced in a single pass, which
+    requires all variables to have the same number of members.
+    
+    :param members: DataFrame with the member columns of each variable, one
+        variable after the other
+    :param n_vars: Number of variables in members
+    :return: Array of shape (rows, variables, 3) with mean, min and max
+    """
+    values = members.to_numpy().reshape(len(members), n_vars, -1)
+    return np.stack(
+        [values.mean(axis=2), values.min(axis=2), values.max(axis=2)], axis=2
     )
 
-    # Add ensemble min and max.
-    df_this["var_lower"] = df_all[col_names].min(axis=1)
-    df_this["var_upper"] = df_all[col_names].max(axis=1)
+
+def stats_frame(stats, variables, index):
+    """
+    Wrap ensemble statistics in a DataFrame with (variable, stat) columns.
+    
+    :param stats: Array of shape (rows, variables, 3) from ensemble_stats
+    :param variables: Variable names
+    :param index: Index for the result
+    :return: DataFrame with two-level columns
+    """
+    columns = pd.MultiIndex.from_product([variables, STATS])
+    return pd.DataFrame(stats.reshape(len(stats), -1), index=index, columns=columns)
+
+
+def get_multi_shaded_data(df_all, variables, ens, freq="Monthly"):
+    """
+    Calculate shaded data for several variables in one batched pass.
+    
+    :param df_all: DataFrame containing all data
+    :param variables: Variables to be used for calculations
+    :param ens: Ensemble for the variables, "Average" for all members or a
+        member number
+    :param freq: Frequency for calculations, one of "Monthly", "Annual", or "Decadal"
+    :return: Dict mapping each variable to a tuple with data output, monthly
+        data, and selected monthly data
+    """
+    print(f"Calculating {freq} average for {', '.join(variables)}...")
+
+    # Extract columns with each variable name, or the one selected member.
+    if ens == "Average":
+        col_names = [member_columns(df_all, var) for var in variables]
+    else:
+        col_names = [pd.Index([f"{var}_{ens}"]) for var in variables]
+    if len({len(cols) for cols in col_names}) > 1:
+        raise ValueError(f"{variables} do not have the same number of ensemble members")
+    all_cols = [col for cols in col_names for col in cols]
+    members = df_all[all_cols]
+    year = df_all["year"]
+
+    # Ensemble average, min and max at every time step.
+    df_this = stats_frame(ensemble_stats(members, len(variables)), variables, df_all.index)
 
     # Group by month and calculate mean.
-    df_monthly = df_this.groupby("month").mean()
+    df_monthly = df_this.groupby(df_all["month"]).mean()
 
     # Select data from 2000 to 2020.
-    mask = (df_this["year"] > 1999) & (df_this["year"] < 2021)
-    df_selected = df_this.loc[mask]
-    df_monthly_selected = df_selected.groupby("month").mean()
+    mask = (year > 1999) & (year < 2021)
+    df_monthly_selected = df_this.loc[mask].groupby(df_all["month"].loc[mask]).mean()
 
-     # Calculate shaded data based on frequency.
+    # Calculate shaded data based on frequency.
     if freq == "Monthly":
         df_out = df_this
-    elif freq == "Annual":
-        # Group by year and calculate mean/min/max based on variable.
-        if var == "TREFHTMN":
-            df_annual = df_all.groupby("year").min().reset_index()
-        elif var == "TREFHTMX":
-            df_annual = df_all.groupby("year").max().reset_index()
-        else:
-            df_annual = df_all.groupby("year").mean().reset_index()
-
-        # Add month and day columns.
-        df_annual["month"] = 6
-        df_annual["day"] = 30
-        # Convert year/month/day to datetime format.
-        df_annual["time"] = pd.to_datetime(df_annual[["year", "month", "day"]])
-
-        # Calculate mean/min/max for variable and create DataFrame.
-        this = df_annual[col_names].mean(axis=1)
-        df_out = pd.DataFrame(
-            {"time": df_annual["time"], "month": df_annual["month"], "var": this}
-        )
-        df_out["var_lower"] = df_annual[col_names].min(axis=1)
-        df_out["var_upper"] = df_annual[col_names].max(axis=1)
-
-    elif freq == "Decadal":
-        # Group by decade and calculate mean/min/max based on variable.
-        df_all['decade'] = df_all['time'].dt.year.floordiv(10).mul(10)
-        if var == "TREFHTMN":
-            df_tmp = df_all.groupby("decade").min().reset_index()
-        elif var == "TREFHTMX":
-            df_tmp = df_all.groupby("decade").max().reset_index()
-        else:
-            df_tmp = df_all.groupby([(df_all.time.dt.year // 10 * 10)]).mean().reset_index()
-
-        # Create a dummy DataFrame to calculate time values.
-        df_dumb = df_all.groupby([(df_all.time.dt.year // 10 * 10)]).mean().reset_index()
-
-        # Add year, month, and day columns.
-        df_tmp["year"] = pd.DatetimeIndex(df_dumb["time"]).year
-        df_tmp["month"] = 6
-        df_tmp["day"] = 30
-
-        # Convert year/month/day to datetime format.
-        df_tmp["time"] = pd.to_datetime(df_tmp[["year", "month", "day"]])
-
-        # Calculate mean/min/max for variable and create DataFrame.
-        this = df_tmp[col_names].mean(axis=1)
-        this_std = df_tmp[col_names].std(axis=1)
-        #this_std.iloc[-1] = this_std.iloc[-2]
-        df_out = pd.DataFrame(
-            {"time": df_tmp["time"], "month": df_tmp["month"], "var": this}
+        time = df_all["time"]
+        period = year.to_numpy()
+    else:
+        if freq == "Annual":
+            group = year
+        elif freq == "Decadal":
+            group = (year // 10 * 10).rename("decade")
+
+        # Group each member by year/decade and take the mean/min/max based on variable.
+        grouped = members.groupby(group)
+        df_group = {}
+        for var, cols in zip(variables, col_names):
+            if var == "TREFHTMN":
+                how = "min"
+            elif var == "TREFHTMX":
+                how = "max"
+            else:
+                how = "mean"
+            df_group.setdefault(how, []).extend(cols)
+        df_group = pd.concat(
+            [grouped[cols].agg(how) for how, cols in df_group.items()], axis=1
+        )[all_cols]
+
+        # Put annual values in the middle of the year and decadal values in
+        # the middle of the decade.
+        period = df_group.index.to_numpy()
+        years = period.astype(int)
+        if freq == "Decadal":
+            years = years + 5
+        time = pd.to_datetime(pd.DataFrame({"year": years, "month": 6, "day": 30}))
+
+        df_out = stats_frame(
+            ensemble_stats(df_group, len(variables)), variables, time.index
         )
-        df_out["var_lower"] = df_tmp[col_names].min(axis=1)
-        df_out["var_upper"] = df_tmp[col_names].max(axis=1)
-        df_out = df_out[:-1]
+
+        if freq == "Decadal" and not last_period_complete(group.to_numpy(), freq):
+            # Drop the last decade when the record ends partway through it.
+            df_out = df_out[:-1]
+            time = time[:-1]
+            period = period[:-1]
 
     # Add month names to DataFrame.
     month_dict = dict(enumerate(calendar.month_abbr))
-    df_monthly["Month"] = df_monthly.index.map(month_dict)
-    df_monthly_selected["Month"] = df_monthly_selected.index.map(month_dict)
+    month_names = df_monthly.index.map(month_dict)
+    month_names_selected = df_monthly_selected.index.map(month_dict)
+
+    results = {}
+    for var in variables:
+        df_var = df_out[var].copy()
+        df_var.insert(0, "time", time)
+        # first year of each point's period, for selecting years by period
+        df_var.insert(1, "period_start", period)
+        df_var_monthly = df_monthly[var].rename_axis("month")
+        df_var_monthly["Month"] = month_names
+        df_var_monthly_selected = df_monthly_selected[var].rename_axis("month")
+        df_var_monthly_selected["Month"] = month_names_selected
+        results[var] = (df_var, df_var_monthly, df_var_monthly_selected)
 
     # Return shaded data and average data.
-    return df_out, df_monthly, df_monthly_selected
\ No newline at end of file
+    return results
+
+
+# Number of years covered by one point at each frequency.
+PERIOD_YEARS = {"Monthly": 1, "Annual": 1, "Decadal": 10}
+
+
+def year_range(period_start, freq):
+    """
+    First and last year covered by a selection of points.
+    
+    :param period_start: Values of the "period_start" column of the selected points
+    :param freq: Frequency of the points, one of "Monthly", "Annual", or "Decadal"
+    :return: Tuple with the first and last year
+    """
+    return int(np.min(period_start)), int(np.max(period_start)) + PERIOD_YEARS[freq] - 1
+
+
+def get_shaded_data(df_all, var, ens, freq="Monthly"):
+    """
+    Calculate shaded data based on the provided variable and frequency.
+    
+    :param df_all: DataFrame containing all data
+    :param var: Variable to be used for calculations
+    :param ens: Ensemble for the variable
+    :param freq: Frequency for calculations, one of "Monthly", "Annual", or "Decadal"
+    :return: Tuple with data output, monthly data, and selected monthly data
+    """
+    return get_multi_shaded_data(df_all, [var], ens, freq)[var]
+
+
+def period_starts(periods):
+    """
+    Positions where a new period (year, decade, ...) begins.
+    
+    :param periods: Sorted array with the period of every time step
+    :return: Integer array of start positions, beginning with 0
+    """
+    return np.concatenate([[0], np.flatnonzero(np.diff(periods)) + 1])
+
+
+def last_period_complete(periods, freq):
+    """
+    Whether the last period of a monthly series has all of its months.
+    
+    :param periods: Sorted array with the period of every monthly time step
+    :param freq: Frequency of the periods, one of "Monthly", "Annual", or "Decadal"
+    :return: True if the last period is complete
+    """
+    last_length = len(periods) - period_starts(periods)[-1]
+    return last_length >= 12 * PERIOD_YEARS[freq]
+
+
+def run_lengths(events):
+    """
+    Length of the run of consecutive events ending at every time step.
+    
+    Runs are counted along the first axis independently for every member,
+    over the whole series.
+    
+    :param events: Boolean array of shape (time, members)
+    :return: Integer array with the same shape as events
+    """
+    counts = np.cumsum(events, axis=0, dtype=np.int32)
+    # -- count of events before the current run started
+    base = np.where(events, 0, counts)
+    return counts - np.maximum.accumulate(base, axis=0)
+
+
+def completed_runs(events):
+    """
+    Length of every run of consecutive events, at the time step it ends.
+    
+    :param events: Boolean array of shape (time, members)
+    :return: Integer array with the same shape as events, holding the run
+        length where a run ends and 0 elsewhere
+    """
+    # -- a run ends where the next step has no event, or at the last step
+    ends = events.copy()
+    ends[:-1] &= ~events[1:]
+    return np.where(ends, run_lengths(events), 0)
+
+
+def get_extreme_data(df_all, var, threshold, above=True, freq="Annual"):
+    """
+    Calculate threshold-exceedance statistics across the ensemble.
+    
+    :param df_all: DataFrame containing all data
+    :param var: Variable to be used for calculations
+    :param threshold: Threshold in the units of the variable
+    :param above: Count months above the threshold (else below it)
+    :param freq: Period to count over, one of "Annual" or "Decadal"
+    :return: Tuple with exceedance counts per period, longest run per period
+        and empirical return periods. A run that crosses a period boundary
+        (e.g. a November to March drought) counts in full towards the period
+        it ends in.
+    """
+    print(f"Calculating {freq} exceedances of {threshold} for {var}...")
+
+    members = df_all[member_columns(df_all, var)].to_numpy()
+    events = members > threshold if above else members < threshold
+
+    year = df_all["year"].to_numpy()
+    periods = year if freq == "Annual" else year // 10 * 10
+    starts = period_starts(periods)
+
+    # Number of exceedances and longest spell of each member in every period.
+    counts = np.add.reduceat(events, starts, axis=0, dtype=np.int32)
+    longest = np.maximum.reduceat(completed_runs(events), starts, axis=0)
+
+    # Put annual values in the middle of the year and decadal values in the
+    # middle of the decade.
+    years = periods[starts].astype(int)
+    if freq == "Decadal":
+        years = years + 5
+    time = pd.to_datetime(pd.DataFrame({"year": years, "month": 6, "day": 30}))
+
+    df_counts = pd.DataFrame(
+        {
+            "time": time,
+            "var": counts.mean(axis=1),
+            "var_lower": counts.min(axis=1),
+            "var_upper": counts.max(axis=1),
+            # fraction of members with at least one event
+            "probability": (counts > 0).mean(axis=1),
+        }
+    )
+    df_runs = pd.DataFrame(
+        {
+            "time": time,
+            "var": longest.mean(axis=1),
+            "var_lower": longest.min(axis=1),
+            "var_upper": longest.max(axis=1),
+        }
+    )
+
+    if freq == "Decadal" and not last_period_complete(periods, freq):
+        # Drop the last decade when the record ends partway through it.
+        df_counts = df_counts[:-1]
+        df_runs = df_runs[:-1]
+        counts = counts[:-1]
+
+    # Probability that a period has at least k events, pooled over all
+    # members and periods, and the matching return period in periods.
+    pooled = np.sort(counts, axis=None)
+    # -- no events (or no complete period) leaves an empty table
+    k = np.arange(1, pooled.max(initial=0) + 1)
+    probability = 1 - np.searchsorted(pooled, k, side="left") / pooled.size
+    df_return = pd.DataFrame(
+        {"events": k, "probability": probability, "return_period": 1 / probability}
+    )
+
+    return df_counts, df_runs, df_return
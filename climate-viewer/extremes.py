@@ -0,0 +1,155 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Extreme-event panel: threshold exceedances across the ensemble.
+
+For the chosen variable and threshold it shows how many months per year (or
+decade) exceed the threshold, the longest spell of consecutive exceeding
+months (counted in the period the spell ends in, so a spell running from
+November into March is one spell), and how often a given number of exceedances occurs. The statistics
+come from the vectorized kernels in data_processing and are cached per
+threshold.
+"""
+
+from bokeh.layouts import row, column
+from bokeh.models import ColumnDataSource, HoverTool, Select, Spinner
+from bokeh.plotting import figure
+
+from cache import cached_extreme_data
+from plot_utils import var_labels, band_plot
+
+
+# -- (direction, threshold, step) shown when a variable is picked
+extreme_defaults = {
+    "TREFHTMX": ("above", 95.0, 1.0),
+    "TREFHTMN": ("below", 32.0, 1.0),
+    "PRECT": ("above", 12.0, 0.5),
+    "SOILWATER_10CM": ("below", 15.0, 0.5),
+}
+
+period_names = {"Annual": "year", "Decadal": "decade"}
+
+
+def extremes_view(file_name, df_all, var="TREFHTMX", freq="Annual"):
+    """
+    Build the extreme-event layout.
+
+    Args:
+        file_name: Path to the CSV file df_all was read from (for caching).
+        df_all: DataFrame containing all data.
+        var: Variable shown initially.
+        freq: Period shown initially, "Annual" or "Decadal".
+
+    Returns:
+        A Bokeh layout with the controls and the three extreme-event plots.
+    """
+    direction, threshold, step = extreme_defaults[var]
+
+    menu_var = Select(
+        options=[(name, label) for name, label in var_labels.items()],
+        value=var,
+        title="Variable",
+    )
+    menu_direction = Select(options=["above", "below"], value=direction, title="Months")
+    menu_threshold = Spinner(value=threshold, step=step, title="Threshold")
+    menu_freq = Select(options=list(period_names), value=freq, title="Per")
+
+    counts_source = ColumnDataSource()
+    runs_source = ColumnDataSource()
+    return_source = ColumnDataSource()
+
+    p_counts = figure(
+        x_axis_type="datetime",
+        tools="pan, wheel_zoom, box_zoom, reset, save",
+        width=800,
+        height=300,
+    )
+    band_plot(p_counts, counts_source, "firebrick")
+    p_counts.add_tools(
+        HoverTool(
+            tooltips=[
+                ("mean", "@var"),
+                ("min/max", "@var_lower / @var_upper"),
+                ("members with events", "@probability{0%}"),
+            ]
+        )
+    )
+    p_counts.xaxis.axis_label = "Time"
+
+    p_runs = figure(
+        x_axis_type="datetime",
+        x_range=p_counts.x_range,
+        tools="pan, wheel_zoom, box_zoom, reset, save",
+        width=800,
+        height=300,
+    )
+    band_plot(p_runs, runs_source, "darkorange")
+    p_runs.xaxis.axis_label = "Time"
+    p_runs.yaxis.axis_label = "Consecutive months"
+
+    p_return = figure(
+        x_axis_type="log",
+        tools="pan, wheel_zoom, box_zoom, reset, save",
+        width=450,
+        height=400,
+        title="Return periods (all members)",
+    )
+    p_return.line("return_period", "events", source=return_source, line_width=3, color="navy")
+    p_return.circle("return_period", "events", source=return_source, size=6, color="navy")
+    p_return.add_tools(
+        HoverTool(tooltips=[("months", "@events"), ("probability", "@probability{0.000%}")])
+    )
+    p_return.grid.grid_line_alpha = 0.5
+
+    # -- set while update_variable resets the controls, to compute only once
+    switching = False
+
+    def update(attr, old, new):
+        """
+        Recompute the statistics for the current controls.
+        """
+        if switching or menu_threshold.value is None:
+            return
+
+        var = menu_var.value
+        freq = menu_freq.value
+        above = menu_direction.value == "above"
+        threshold = menu_threshold.value
+        df_counts, df_runs, df_return = cached_extreme_data(
+            file_name, df_all, var, threshold, above, freq
+        )
+        counts_source.data = ColumnDataSource.from_df(df_counts)
+        runs_source.data = ColumnDataSource.from_df(df_runs)
+        return_source.data = ColumnDataSource.from_df(df_return)
+
+        period = period_names[freq]
+        condition = f"{menu_direction.value} {threshold:g}"
+        p_counts.title.text = f"{var_labels[var]}: months {condition} per {period}"
+        p_counts.yaxis.axis_label = f"Months per {period}"
+        p_runs.title.text = f"Longest spell {condition} ending in each {period}"
+        p_return.xaxis.axis_label = f"Return period [{period}s]"
+        p_return.yaxis.axis_label = f"Months {condition} per {period}"
+
+    def update_variable(attr, old, new):
+        """
+        Switch to the default threshold of the newly selected variable.
+        """
+        nonlocal switching
+        direction, threshold, step = extreme_defaults[new]
+        switching = True
+        try:
+            menu_direction.value = direction
+            menu_threshold.step = step
+            menu_threshold.value = threshold
+        finally:
+            switching = False
+        update(attr, old, new)
+
+    menu_var.on_change("value", update_variable)
+    menu_direction.on_change("value", update)
+    menu_threshold.on_change("value", update)
+    menu_freq.on_change("value", update)
+    update("value", None, var)
+
+    controls = column(menu_var, menu_direction, menu_threshold, menu_freq)
+    return row(column(p_counts, p_runs), column(controls, p_return))
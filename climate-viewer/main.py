@@ -2,42 +2,41 @@
 # Import Libraries
 
 import os
+import sys
 import time
-import yaml
 import calendar
 
 import numpy as np
 import pandas as pd
 
-from os.path import join
-from glob import glob
-
-from bokeh.themes import Theme
-
 from bokeh.models import (
     ColumnDataSource,
     Button,
     CustomJS,
-    DataTable,
-    Slider,
-    Dropdown,
     Select,
-    PreText,
-    Label,
-    Slope,
     Band,
-    NumberFormatter,
-    RangeSlider,
-    TableColumn,
+    Div,
+    HoverTool,
+    Panel,
+    Tabs,
 )
 from bokeh.layouts import row, column
-from data_processing import read_data, extract_time_information, get_shaded_data
+from data_processing import get_shaded_data, year_range
+from cache import cached_read_data, cached_shaded_data
+from compare import comparison_view
+from extremes import extremes_view
+from resources import load_theme, load_download_js, default_view
+from sessions import admit, manage_session, message_page, session_nbytes
 from bokeh.io import output_notebook, show, curdoc
 from bokeh.plotting import figure
-from bokeh.models import ColumnDataSource, HoverTool
 
 # -- only for running in the notebook:
 def in_notebook():
+    # -- a notebook kernel has always imported IPython already; don't pay
+    # -- for importing it on the server
+    if "IPython" not in sys.modules:
+        return False
+
     from IPython import get_ipython
 
     if get_ipython():
@@ -75,9 +74,13 @@ vars_dict = {
 
 input_file = "data/dummy.csv"
 
-# Read and process data
-df_all = read_data(input_file)
-df_all = extract_time_information(df_all)
+# -- float32 members and narrow time keys; about half the memory per site
+compact_storage = os.environ.get("CLIMATE_VIEWER_COMPACT", "1") == "1"
+
+# Read and process data (from the on-disk cache when it is warm)
+load_start = time.perf_counter()
+df_all = cached_read_data(input_file, compact_storage)
+print(f"Loaded {input_file} in {time.perf_counter() - load_start:.3f}s")
 
 
 def shaded_tseries1(doc):
@@ -271,33 +274,7 @@ def shaded_tseries1(doc):
 
     # toolbar_location: above
 
-    doc.theme = Theme(
-        json=yaml.load(
-            """
-        global-styling:
-          css:
-            theme:
-              https://fonts.googleapis.com/css?family=Quicksand: { type: external }
-
-        attrs:
-            Figure:
-                background_fill_color: "#FFFFFF"
-                outline_line_color: "grey"
-                height: 700
-                width: 1300
-            Grid:
-                grid_line_dash: [6, 4]
-                grid_line_color: grey
-            Title:
-                text_color: "black"
-            Axis:
-                major_label_text_font: "Verdana"
-                major_label_text_font_style: "normal"
-                major_label_text_font_size: "18px"
-    """,
-            Loader=yaml.FullLoader,
-        )
-    )
+    doc.theme = load_theme()
 
 
 
@@ -306,20 +283,12 @@ def shaded_tseries1(doc):
 def shaded_tseries(doc):
 
 
-    df_new, df_monthly, df_monthly_selected = get_shaded_data(
-        df_all, default_var, default_ens, default_freq
+    data_new, data_monthly, data_monthly_selected = default_view(
+        input_file, default_var, default_ens, default_freq, compact_storage
     )
-    print("~~~~~~~~")
-
-    print("~~~~~~~~")
-    print(df_monthly)
-    print(df_monthly_selected)
-    print("~~~~~~~~")
-    print("~~~~~~~~")
-
-    source = ColumnDataSource(df_new)
-    source2 = ColumnDataSource(df_monthly)
-    source3 = ColumnDataSource(df_monthly_selected)
+    source = ColumnDataSource(data_new)
+    source2 = ColumnDataSource(data_monthly)
+    source3 = ColumnDataSource(data_monthly_selected)
 
     freq_list = ["Monthly", "Annual", "Decadal"]
     plot_vars = ["TREFHTMN", "TREFHTMX", "PRECT", "SOILWATER_10CM"]
@@ -504,8 +473,8 @@ def shaded_tseries(doc):
         new_var = vars_dict2[menu.value]
         print(" - var2 : ", new_var)
 
-        df_new, df_monthly, df_monthly_selected = get_shaded_data(
-            df_all, new_var, menu_ens.value, menu_freq.value
+        df_new, df_monthly, df_monthly_selected = cached_shaded_data(
+            input_file, df_all, new_var, menu_ens.value, menu_freq.value
         )
 
         # q.add_layout(mytext)
@@ -516,6 +485,7 @@ def shaded_tseries(doc):
         source2.data = df_monthly
         source3.data = df_monthly_selected
         # source.stream(df_new)
+        print(f"Session data: {session_nbytes(doc)} bytes")
 
     def update_yaxis(attr, old, new):
         if vars_dict2[menu.value] == "TREFHTMN":
@@ -547,51 +517,47 @@ def shaded_tseries(doc):
 
     def selection_change(attrname, old, new):
         # print ("calling dsjkghkjasdhgkjads")
-        df_new, df_monthly, df_monthly_selected = get_shaded_data(
-            df_all, vars_dict2[menu.value], menu_ens.value, menu_freq.value
+        df_new, df_monthly, df_monthly_selected = cached_shaded_data(
+            input_file, df_all, vars_dict2[menu.value], menu_ens.value, menu_freq.value
         )
         selected = source.selected.indices
         # print ('selected:', selected)
         # print (type (selected))
         if selected:
             # print ('selected is')
-            df_new = df_new.iloc[selected, :]
-            df_new["year"] = pd.DatetimeIndex(df_new["time"]).year
-            year_min = df_new["year"].min()
-            year_max = df_new["year"].max()
+            # -- decadal points sit mid-decade; select by the years they cover
+            year_min, year_max = year_range(
+                df_new["period_start"].iloc[selected], menu_freq.value
+            )
             # print (year_min)
             # print (year_max)
-            print(df_new)
             this_df = df_all.loc[
                 (df_all["year"] >= year_min) & (df_all["year"] <= year_max)
             ]
+            # -- one-off year ranges are not worth a cache entry; only the
+            # -- seasonal cycle is needed, which the monthly path gives cheapest
             df_new2, df_monthly, df_monthly_selected = get_shaded_data(
-                this_df, vars_dict2[menu.value], menu_ens.value, menu_freq.value
+                this_df, vars_dict2[menu.value], menu_ens.value
             )
+            if year_min == year_max:
+                q.title.text = "Seasonal Cycle for " + str(year_min)
+            else:
+                q.title.text = "Seasonal Cycle for " + str(year_min) + "-" + str(year_max)
         else:
-            print("selected is empty")
+            q.title.text = "Seasonal Cycle for 1850-2100"
 
-        if year_min == year_max:
-            q.title.text = "Seasonal Cycle for " + str(year_min)
-        else:
-            q.title.text = "Seasonal Cycle for " + str(year_min) + "-" + str(year_max)
         # update_stats(df_new)
-        # print (qpoints.data_source.data )
-        print(df_monthly)
+        # -- qpoints and qlines both draw from source2
         source2.data = df_monthly
-        qpoints.data_source.data = df_monthly
-        qlines.data_source.data = df_monthly
 
+    # -- register each callback once; every registration is another recompute
     source.selected.on_change("indices", selection_change)
-    source.selected.on_change("indices", selection_change)
-    source2.selected.on_change("indices", selection_change)
-    source2.selected.on_change("indices", selection_change)
 
     # button = Button(label="Download", button_type="success", css_classes=['btn_style'])
     button = Button(label="Download", css_classes=["btn_style"])
     button.js_on_event(
         "button_click",
-        CustomJS(args=dict(source=source), code=open(join(".", "download.js")).read()),
+        CustomJS(args=dict(source=source), code=load_download_js()),
     )
 
     # layout = row(column(menu, menu_freq, menu_site, q),  p)
@@ -608,44 +574,40 @@ def shaded_tseries(doc):
     # layout = row(column(menu, menu_freq, menu_site, q),  p)
     # layout = row(p)
 
-    doc.add_root(layout)
-    source.selected.on_change("indices", selection_change)
-    source2.selected.on_change("indices", selection_change)
+    # -- the comparison and extremes views are built the first time their
+    # -- tab is opened, so sessions that never use them don't pay for them
+    lazy_views = {
+        "Compare Variables": lambda: comparison_view(df_all, menu_ens.value),
+        "Extremes": lambda: extremes_view(input_file, df_all),
+    }
 
-    # toolbar_location: above
+    def open_tab(attr, old, new):
+        panel = tabs.tabs[new]
+        if panel.title in lazy_views:
+            panel.child.children = [lazy_views.pop(panel.title)()]
 
-    doc.theme = Theme(
-        json=yaml.load(
-            """
-        global-styling:
-          css:
-            theme:
-              https://fonts.googleapis.com/css?family=Quicksand: { type: external }
-
-        attrs:
-            Figure:
-                background_fill_color: "#FFFFFF"
-                outline_line_color: "grey"
-                height: 700
-                width: 1300
-            Grid:
-                grid_line_dash: [6, 4]
-                grid_line_color: grey
-            Title:
-                text_color: "black"
-            Axis:
-                major_label_text_font: "Verdana"
-                major_label_text_font_style: "normal"
-                major_label_text_font_size: "18px"
-    """,
-            Loader=yaml.FullLoader,
-        )
+    tabs = Tabs(
+        tabs=[Panel(child=layout, title="Explorer")]
+        + [Panel(child=column(Div(text="Loading…")), title=title) for title in lazy_views]
     )
+    tabs.on_change("active", open_tab)
+
+    doc.add_root(tabs)
+    manage_session(doc)
+
+    # toolbar_location: above
+
+    doc.theme = load_theme()
 
 
 
 if ShowWebpage:
-    shaded_tseries(curdoc())
+    admitted, reason = admit()
+    if admitted:
+        shaded_tseries(curdoc())
+    else:
+        print(f"Refusing new session: {reason}")
+        message_page(curdoc(), "The server is busy right now. Please try again in a few minutes.")
 else:
     # show(bkapp)
     show(shaded_tseries)
\ No newline at end of file
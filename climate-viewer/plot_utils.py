@@ -0,0 +1,42 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Labels and plotting helpers shared by the comparison and extremes views.
+"""
+
+from bokeh.models import Band
+
+
+var_labels = {
+    "TREFHTMN": "Minimum Temperature [°F]",
+    "TREFHTMX": "Maximum Temperature [°F]",
+    "PRECT": "Total Precipitation [inch/month]",
+    "SOILWATER_10CM": "Soil Moisture [kg/m2]",
+}
+
+freq_list = ["Monthly", "Annual", "Decadal"]
+
+
+def band_plot(p, source, color, fill_color=None):
+    """
+    Draw an ensemble mean line with its min/max band.
+
+    Args:
+        p: A Bokeh figure on which the plot is drawn.
+        source: ColumnDataSource with time, var, var_lower and var_upper.
+        color: Line color.
+        fill_color: Band color, the line color if not given.
+    """
+    p.line("time", "var", source=source, alpha=0.8, line_width=3, color=color)
+    p.add_layout(
+        Band(
+            base="time",
+            lower="var_lower",
+            upper="var_upper",
+            source=source,
+            level="underlay",
+            fill_alpha=0.3,
+            fill_color=fill_color or color,
+        )
+    )
+    p.grid.grid_line_alpha = 0.5
@@ -0,0 +1,89 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Per-process resources shared by every session.
+
+`bokeh serve` runs main.py again for every new session, but imported modules
+stay loaded. Anything that does not depend on the session is therefore built
+here, once per server process, and handed out to each new document.
+"""
+
+import functools
+
+from bokeh.models import ColumnDataSource
+from bokeh.themes import Theme
+
+from cache import file_hash, cached_read_data, cached_shaded_data
+
+
+THEME_YAML = """
+        global-styling:
+          css:
+            theme:
+              https://fonts.googleapis.com/css?family=Quicksand: { type: external }
+
+        attrs:
+            Figure:
+                background_fill_color: "#FFFFFF"
+                outline_line_color: "grey"
+                height: 700
+                width: 1300
+            Grid:
+                grid_line_dash: [6, 4]
+                grid_line_color: grey
+            Title:
+                text_color: "black"
+            Axis:
+                major_label_text_font: "Verdana"
+                major_label_text_font_style: "normal"
+                major_label_text_font_size: "18px"
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def load_theme():
+    """
+    Parse the dashboard theme.
+
+    :return: Bokeh Theme shared by all documents
+    """
+    import yaml
+
+    return Theme(json=yaml.load(THEME_YAML, Loader=yaml.FullLoader))
+
+
+@functools.lru_cache(maxsize=None)
+def load_download_js(file_name="download.js"):
+    """
+    Read the JavaScript behind the Download button.
+
+    :param file_name: Path to the JavaScript file
+    :return: Source code of the callback
+    """
+    with open(file_name) as f:
+        return f.read()
+
+
+@functools.lru_cache(maxsize=8)
+def _default_view(file_name, data_hash, var, ens, freq, compact):
+    df_all = cached_read_data(file_name, compact)
+    frames = cached_shaded_data(file_name, df_all, var, ens, freq)
+    return tuple(ColumnDataSource.from_df(df) for df in frames)
+
+
+def default_view(file_name, var, ens, freq, compact=False):
+    """
+    Column data for the default view, built once per process.
+
+    Callers get fresh dicts that share the (read-only) column arrays, so a
+    new session only has to wrap them in its own ColumnDataSources.
+
+    :param file_name: Path to the CSV file
+    :param var: Variable to be used for calculations
+    :param ens: Ensemble for the variable
+    :param freq: Frequency for calculations, one of "Monthly", "Annual", or "Decadal"
+    :param compact: Use the compact (float32, narrow time keys) storage
+    :return: Tuple of column dicts for data output, monthly data, and selected monthly data
+    """
+    view = _default_view(file_name, file_hash(file_name), var, ens, freq, compact)
+    return tuple(dict(data) for data in view)
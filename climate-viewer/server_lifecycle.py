@@ -0,0 +1,15 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Server lifecycle hooks, picked up by `bokeh serve` for directory apps.
+"""
+
+from tornado.ioloop import PeriodicCallback
+
+from sessions import IDLE_CHECK_MS, expire_idle_sessions
+
+
+def on_server_loaded(server_context):
+    # -- one sweep for the whole process instead of a timer per session;
+    # -- this hook runs on the server's IO loop, which the callback joins
+    PeriodicCallback(expire_idle_sessions, IDLE_CHECK_MS).start()
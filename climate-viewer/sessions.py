@@ -0,0 +1,197 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Session lifecycle: admission control, idle timeouts and cleanup.
+
+Like resources.py, this module is imported once per server process, so the
+registry below sees every session the process serves. Closed tabs are
+discarded by `bokeh serve` itself (see --unused-session-lifetime). Tabs that
+stay open but unused are released here after an idle timeout, and new
+sessions are turned away once the session or memory limit is reached.
+"""
+
+import ctypes
+import gc
+import os
+import time
+import weakref
+
+from functools import partial
+
+import numpy as np
+import psutil
+
+from bokeh.models import ColumnDataSource, Div
+
+
+MAX_SESSIONS = int(os.environ.get("CLIMATE_VIEWER_MAX_SESSIONS", "50"))
+MAX_MEMORY_BYTES = int(os.environ.get("CLIMATE_VIEWER_MAX_MEMORY_MB", "450")) * 2**20
+IDLE_TIMEOUT = float(os.environ.get("CLIMATE_VIEWER_IDLE_MINUTES", "30")) * 60
+
+# -- how often the server looks for idle sessions
+IDLE_CHECK_MS = 60 * 1000
+
+# -- id(doc) -> [weak reference to doc, time of the last change], for every
+# -- live session; weak so that the registry never keeps a document alive
+_sessions = {}
+
+# -- set when a session is destroyed or expired, so the next sweep trims
+_released = False
+
+# -- glibc's malloc_trim, looked up once; the symbols already loaded into the
+# -- process include the C library, so no library search is needed
+try:
+    _malloc_trim = ctypes.CDLL(None).malloc_trim
+except (OSError, AttributeError, TypeError):
+    _malloc_trim = None
+
+
+def session_count():
+    """
+    Number of live sessions in this process.
+
+    :return: Count of registered sessions
+    """
+    return len(_sessions)
+
+
+def memory_in_use():
+    """
+    Resident memory of this process.
+
+    :return: Size in bytes
+    """
+    return psutil.Process().memory_info().rss
+
+
+def session_nbytes(doc):
+    """
+    Bytes held by the column data of a session's ColumnDataSources.
+
+    Arrays shared with other sessions (such as the default view) are
+    counted too, since the session keeps them alive.
+
+    :param doc: Bokeh document of the session
+    :return: Size in bytes (object columns count their pointers only)
+    """
+    return sum(
+        np.asarray(values).nbytes
+        for source in doc.select({"type": ColumnDataSource})
+        for values in source.data.values()
+    )
+
+
+def trim_memory():
+    """
+    Hand memory freed by closed sessions back to the operating system.
+
+    glibc keeps freed heap pages for reuse, so without this the resident size
+    stays at its peak after a burst of sessions. Does nothing on other C
+    libraries.
+    """
+    gc.collect()
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+
+
+def admit():
+    """
+    Decide whether a new session may be created.
+
+    :return: Tuple with a bool and, when refused, the reason
+    """
+    if session_count() >= MAX_SESSIONS:
+        return False, f"{session_count()} sessions are already open"
+    if memory_in_use() >= MAX_MEMORY_BYTES:
+        return False, f"memory use is above {MAX_MEMORY_BYTES // 2**20} MB"
+    return True, ""
+
+
+def message_page(doc, text):
+    """
+    Replace the contents of a document with a short message.
+
+    :param doc: Bokeh document
+    :param text: Message to show
+    """
+    doc.clear()
+    doc.add_root(Div(text=f"<h2>{text}</h2>"))
+
+
+def release_session(doc):
+    """
+    Drop the data held by a session's ColumnDataSources and its layout.
+
+    :param doc: Bokeh document of the session
+    """
+    for source in doc.select({"type": ColumnDataSource}):
+        source.data = {}
+    doc.clear()
+
+
+def manage_session(doc):
+    """
+    Register a session so that idle timeouts and admission control see it.
+
+    Any change to the document counts as activity. The session is
+    unregistered when Bokeh destroys it.
+
+    :param doc: Bokeh document of the session
+    """
+    key = id(doc)
+    _sessions[key] = [weakref.ref(doc), time.monotonic()]
+
+    def touch(event):
+        if key in _sessions:
+            _sessions[key][1] = time.monotonic()
+
+    def session_destroyed(session_context):
+        # -- Bokeh has already detached the document's models and dropped their
+        # -- property values; only our own bookkeeping is left
+        global _released
+        _sessions.pop(key, None)
+        _released = True
+
+    doc.on_change(touch)
+    doc.on_session_destroyed(session_destroyed)
+
+
+def expire_idle_sessions():
+    """
+    Release every session that has been idle for longer than IDLE_TIMEOUT.
+
+    Runs periodically on the server (see server_lifecycle.py). The release
+    itself is scheduled on each document so it runs under the document lock.
+    Memory is only trimmed when a session went away since the last sweep.
+    """
+    global _released
+    now = time.monotonic()
+    for key, (doc_ref, last_activity) in list(_sessions.items()):
+        doc = doc_ref()
+        if doc is None:
+            _sessions.pop(key, None)
+            _released = True
+        elif now - last_activity > IDLE_TIMEOUT:
+            _sessions.pop(key, None)
+            doc.add_next_tick_callback(partial(expire_session, doc_ref))
+
+    # -- sessions closed since the last sweep have been freed by now
+    if _released:
+        _released = False
+        trim_memory()
+
+
+def expire_session(doc_ref):
+    """
+    Release an idle session and tell the user how to get it back.
+
+    :param doc_ref: Weak reference to the session's document
+    """
+    doc = doc_ref()
+    if doc is None:
+        return
+    global _released
+    print(f"Expiring idle session holding {session_nbytes(doc)} bytes of data")
+    release_session(doc)
+    _released = True
+    message_page(doc, "This session was closed after a period of inactivity. Reload the page to continue.")
@@ -0,0 +1,70 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+def save_frames(path, frames):
+    """
+    Write named DataFrames to a columnar .npz file.
+
+    Every column (and the index) is stored as its own array under the key
+    "<frame name>/<column name>", so no pickling is needed to read it back.
+    The file is written to a unique temporary name first and then moved into
+    place, which means a partially written file is never mistaken for a
+    finished one, even when several processes write the same path.
+
+    :param path: Destination file name (should end in .npz)
+    :param frames: Dict mapping a product name to a DataFrame
+    :return: Path of the written file
+    """
+    arrays = {}
+    for name, df in frames.items():
+        index_name = df.index.name or "index"
+        arrays[f"{name}/__index__"] = np.array([index_name])
+        df = df.reset_index().rename(columns={"index": index_name})
+        for col in df.columns:
+            values = df[col].to_numpy()
+            if values.dtype == object:
+                values = values.astype(str)
+            arrays[f"{name}/{col}"] = values
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+def load_frames(path):
+    """
+    Read DataFrames written by save_frames.
+
+    :param path: Path to the .npz file
+    :return: Dict mapping a product name to a DataFrame
+    """
+    columns = {}
+    with np.load(path, allow_pickle=False) as data:
+        for key in data.files:
+            name, col = key.split("/", 1)
+            columns.setdefault(name, {})[col] = data[key]
+
+    frames = {}
+    for name, cols in columns.items():
+        index_name = str(cols.pop("__index__")[0])
+        df = pd.DataFrame(cols).set_index(index_name)
+        if index_name == "index":
+            df.index.name = None
+            # -- restore a default index without holding one integer per row
+            if (df.index == np.arange(len(df))).all():
+                df.index = pd.RangeIndex(len(df))
+        frames[name] = df
+    return frames
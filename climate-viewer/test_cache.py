@@ -0,0 +1,111 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Behaviour of the on-disk cache and the .npz storage it is built on.
+
+Run from the repository root with `python -m pytest climate-viewer`.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+
+from storage import save_frames, load_frames
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_cache_bytes", {})
+    return str(tmp_path)
+
+
+def frame(n=100):
+    return pd.DataFrame({"a": np.arange(n, dtype="float64")})
+
+
+def test_round_trip_keeps_index_and_dtypes(tmp_path):
+    time = pd.date_range("2000-01-01", periods=4, freq="MS")
+    df_default = pd.DataFrame(
+        {
+            "time": time,
+            "year": time.year.astype("int16"),
+            "month": time.month.astype("int8"),
+            "var": np.arange(4, dtype="float32"),
+            "Month": ["Jan", "Feb", "Mar", "Apr"],
+        }
+    )
+    df_named = pd.DataFrame({"var": [1.0, 2.0]}, index=pd.Index([3, 7], name="month"))
+    df_other = pd.DataFrame({"var": [1.0, 2.0]}, index=[5, 6])
+
+    path = save_frames(str(tmp_path / "frames.npz"), {"d": df_default, "n": df_named, "o": df_other})
+    frames = load_frames(path)
+
+    pd.testing.assert_frame_equal(frames["d"], df_default)
+    assert isinstance(frames["d"].index, pd.RangeIndex)
+    pd.testing.assert_frame_equal(frames["n"], df_named)
+    assert frames["o"].index.tolist() == [5, 6]
+    assert os.listdir(tmp_path) == ["frames.npz"]
+
+
+def test_key_changes_with_file_and_code(tmp_path, monkeypatch):
+    data = tmp_path / "data.csv"
+    data.write_text("time,X_0\n2000-01-01,1\n")
+    key = cache.cache_key("read_data", cache.file_hash(str(data)))
+
+    data.write_text("time,X_0\n2000-01-01,2.5\n")
+    assert cache.cache_key("read_data", cache.file_hash(str(data))) != key
+
+    data.write_text("time,X_0\n2000-01-01,1\n")
+    assert cache.cache_key("read_data", cache.file_hash(str(data))) == key
+    monkeypatch.setattr(cache, "_code_version", "edited data_processing.py")
+    assert cache.cache_key("read_data", cache.file_hash(str(data))) != key
+
+
+def test_prune_removes_least_recently_used(cache_dir):
+    for age, name in enumerate(["new", "middle", "old"]):
+        path = save_frames(os.path.join(cache_dir, name + ".npz"), {"x": frame()})
+        os.utime(path, (1000 - age, 1000 - age))
+    size = os.path.getsize(os.path.join(cache_dir, "new.npz"))
+
+    assert cache.prune_cache(cache_dir, max_bytes=2 * size) == 1
+    assert sorted(os.listdir(cache_dir)) == ["middle.npz", "new.npz"]
+    assert cache._cache_bytes[cache_dir] == 2 * size
+
+
+def test_misses_track_size_without_rescanning(cache_dir, monkeypatch):
+    scans = []
+    prune_cache = cache.prune_cache
+    monkeypatch.setattr(cache, "prune_cache", lambda d: scans.append(d) or prune_cache(d))
+
+    cache.load_or_compute("a", lambda: {"x": frame()}, cache_dir)
+    size = os.path.getsize(os.path.join(cache_dir, "a.npz"))
+    cache.load_or_compute("b", lambda: {"x": frame()}, cache_dir)
+    assert len(scans) == 1
+    assert cache._cache_bytes[cache_dir] == 2 * size
+
+    # -- a miss that would pass the limit rescans and prunes the oldest entry
+    monkeypatch.setattr(cache, "CACHE_MAX_BYTES", 2 * size)
+    os.utime(os.path.join(cache_dir, "a.npz"), (1000, 1000))
+    cache.load_or_compute("c", lambda: {"x": frame()}, cache_dir)
+    assert len(scans) == 2
+    assert sorted(os.listdir(cache_dir)) == ["b.npz", "c.npz"]
+
+
+def test_hit_skips_compute(cache_dir):
+    cache.load_or_compute("a", lambda: {"x": frame()}, cache_dir)
+    frames = cache.load_or_compute("a", lambda: pytest.fail("recomputed a cached entry"), cache_dir)
+    pd.testing.assert_frame_equal(frames["x"], frame())
+
+
+def test_unreadable_entry_is_rebuilt(cache_dir):
+    path = os.path.join(cache_dir, "a.npz")
+    with open(path, "wb") as f:
+        f.write(b"truncated")
+
+    frames = cache.load_or_compute("a", lambda: {"x": frame()}, cache_dir)
+    pd.testing.assert_frame_equal(frames["x"], frame())
+    pd.testing.assert_frame_equal(load_frames(path)["x"], frame())
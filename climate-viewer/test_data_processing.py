@@ -0,0 +1,156 @@
+# Author: Negin Sobhani
+# Email: negins@ucar.edu
+"""
+Checks of the batched ensemble reduction and the vectorized extreme-event
+kernels against straightforward pandas and plain-loop references.
+
+Run from the repository root with `python -m pytest climate-viewer`.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import (
+    read_data,
+    extract_time_information,
+    member_columns,
+    get_shaded_data,
+    get_multi_shaded_data,
+    period_starts,
+    run_lengths,
+    completed_runs,
+    get_extreme_data,
+)
+
+
+DATA_FILE = os.path.join(os.path.dirname(__file__), "..", "data", "dummy.csv")
+VARIABLES = ["TREFHTMN", "TREFHTMX", "PRECT", "SOILWATER_10CM"]
+FREQUENCIES = ["Monthly", "Annual", "Decadal"]
+
+
+@pytest.fixture(scope="module")
+def df_all():
+    return extract_time_information(read_data(DATA_FILE))
+
+
+def reference_series(df_all, columns, var, freq):
+    """
+    Ensemble mean, min and max of one variable, one pandas step at a time.
+    """
+    members = df_all[columns]
+    if freq != "Monthly":
+        periods = df_all["year"] if freq == "Annual" else df_all["year"] // 10 * 10
+        how = {"TREFHTMN": "min", "TREFHTMX": "max"}.get(var, "mean")
+        members = members.groupby(periods).agg(how)
+        if freq == "Decadal" and (periods == periods.iloc[-1]).sum() < 120:
+            members = members.iloc[:-1]
+    return pd.DataFrame(
+        {"var": members.mean(axis=1), "var_lower": members.min(axis=1), "var_upper": members.max(axis=1)}
+    ).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("freq", FREQUENCIES)
+def test_batched_matches_per_variable(df_all, freq):
+    batched = get_multi_shaded_data(df_all, VARIABLES, "Average", freq)
+    for var in VARIABLES:
+        single = get_shaded_data(df_all, var, "Average", freq)
+        for df_batched, df_single in zip(batched[var], single):
+            pd.testing.assert_frame_equal(df_batched, df_single)
+
+        df_out = batched[var][0].reset_index(drop=True)
+        expected = reference_series(df_all, member_columns(df_all, var), var, freq)
+        pd.testing.assert_frame_equal(df_out[expected.columns], expected)
+
+
+@pytest.mark.parametrize("freq", FREQUENCIES)
+def test_single_member(df_all, freq):
+    results = get_multi_shaded_data(df_all, VARIABLES, "3", freq)
+    for var in VARIABLES:
+        df_out = results[var][0].reset_index(drop=True)
+        expected = reference_series(df_all, [f"{var}_3"], var, freq)
+        pd.testing.assert_frame_equal(df_out[expected.columns], expected)
+        assert (df_out["var_lower"] == df_out["var_upper"]).all()
+
+
+def loop_run_lengths(events):
+    runs = np.zeros(events.shape, dtype=int)
+    for m in range(events.shape[1]):
+        run = 0
+        for t in range(events.shape[0]):
+            run = run + 1 if events[t, m] else 0
+            runs[t, m] = run
+    return runs
+
+
+def random_events(seed=0, shape=(240, 7)):
+    return np.random.default_rng(seed).random(shape) < 0.4
+
+
+def test_period_starts():
+    periods = np.array([1850, 1850, 1850, 1851, 1860, 1860, 1870])
+    assert period_starts(periods).tolist() == [0, 3, 4, 6]
+    assert period_starts(np.array([1990] * 12)).tolist() == [0]
+
+
+def test_run_lengths_matches_loop():
+    events = random_events()
+    assert (run_lengths(events) == loop_run_lengths(events)).all()
+
+
+def test_completed_runs_keeps_only_run_ends():
+    events = np.array([[0, 1, 1, 0, 1, 1, 1]], dtype=bool).T
+    assert completed_runs(events)[:, 0].tolist() == [0, 0, 2, 0, 0, 0, 3]
+
+
+def test_longest_spell_crosses_years():
+    # -- a November to March spell counts as one 5-month spell in the second year
+    time = pd.date_range("1990-01-01", periods=24, freq="MS")
+    values = np.zeros(24)
+    values[[10, 11, 12, 13, 14]] = 1
+    df = pd.DataFrame({"time": time, "year": time.year, "month": time.month, "X_0": values})
+    _, df_runs, _ = get_extreme_data(df, "X", 0.5, True, "Annual")
+    assert df_runs["var"].tolist() == [0, 5]
+
+
+def test_longest_spell_matches_loop():
+    events = random_events(1)
+    periods = np.repeat(np.arange(1850, 1870), 12)
+    starts = period_starts(periods)
+    longest = np.maximum.reduceat(completed_runs(events), starts, axis=0)
+
+    runs = loop_run_lengths(events)
+    expected = np.zeros(longest.shape, dtype=int)
+    for m in range(events.shape[1]):
+        for t in range(events.shape[0]):
+            run_ends = events[t, m] and (t + 1 == len(events) or not events[t + 1, m])
+            if run_ends:
+                p = np.searchsorted(starts, t, side="right") - 1
+                expected[p, m] = max(expected[p, m], runs[t, m])
+    assert (longest == expected).all()
+
+
+def monthly_frame(start, end):
+    time = pd.date_range(start, end, freq="MS")
+    return pd.DataFrame({"time": time, "year": time.year, "month": time.month, "X_0": 1.0})
+
+
+@pytest.mark.parametrize(
+    "start, end, decades",
+    [
+        ("1990-01-01", "2009-12-01", [1990, 2000]),  # ends on a decade boundary
+        ("1990-01-01", "2000-12-01", [1990]),  # partial last decade
+        ("1990-01-01", "1999-06-01", []),  # no complete decade
+    ],
+)
+def test_only_a_partial_last_decade_is_dropped(start, end, decades):
+    df = monthly_frame(start, end)
+    df_counts, df_runs, df_return = get_extreme_data(df, "X", 0.5, True, "Decadal")
+    assert df_counts["time"].dt.year.tolist() == [decade + 5 for decade in decades]
+    assert len(df_runs) == len(decades)
+    assert len(df_return) == (12 * 10 if decades else 0)
+
+    df_out = get_shaded_data(df, "X", "Average", "Decadal")[0]
+    assert df_out["period_start"].tolist() == decades